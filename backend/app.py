@@ -6,46 +6,161 @@ Wire protocol (extension → backend):
   Frame 1 (text):   { "event": "chunk", "index": N, "start": s, "end": s, "mimeType": "..." }
   Frame 2 (binary): <raw audio bytes>
 
-Wire protocol (backend → extension):
+Wire protocol (backend → extension, JSON in binary frames):
   { "event": "subtitle", "text": "...", "start": s, "end": s }
   { "event": "ack",      "index": N }
   { "event": "error",    "message": "..." }
 
 Key design: cumulative_time is tracked per-connection so that Whisper's
 per-chunk segment timestamps are converted to global stream time.
+
+Chunks from all connections go through a micro-batching queue: whatever
+queued up while Whisper was busy (plus anything arriving within
+WHISPER_BATCH_WINDOW_MS, 0 by default) is transcribed in one batched call.
 """
 
 import asyncio
-import json
 import logging
-import traceback
-from contextlib import asynccontextmanager
+import os
+import queue
+import sys
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
 from functools import partial
-from typing import Optional
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Optional
 
+import msgspec
+import orjson
 import uvicorn
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 
-from whisper_pipeline import WhisperPipeline
+from whisper_pipeline import Segment, WhisperPipeline, get_pipeline
 
 # ── Logging ────────────────────────────────────────────────────────────────────
-logging.basicConfig(
-    level  = logging.INFO,
-    format = "%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-)
 log = logging.getLogger("app")
 
+def _start_logging() -> QueueListener:
+    """
+    Route logging through a queue: records are only enqueued on the calling
+    thread and a QueueListener thread does the actual (possibly slow) stderr
+    write, so logging never stalls the event loop. Called once from lifespan —
+    not at import, since `python app.py` imports this module a second time
+    as "app" for uvicorn.
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    stderr_handler = logging.StreamHandler()
+    stderr_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))   # prefix is added by stderr_handler
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
+    listener = QueueListener(log_queue, stderr_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+# ── Wire protocol ──────────────────────────────────────────────────────────────
+class ChunkMeta(msgspec.Struct):
+    event:    str             = "chunk"
+    index:    int             = -1
+    start:    Optional[float] = None     # None → continue from cumulative_time
+    end:      Optional[float] = None
+    mimeType: str             = "audio/webm"
+
+chunk_meta_decoder = msgspec.json.Decoder(ChunkMeta)
+
+# ── Micro-batching ─────────────────────────────────────────────────────────────
+BATCH_WINDOW_MS = float(os.getenv("WHISPER_BATCH_WINDOW_MS", "0"))   # >0 only pays off with many clients
+BATCH_MAX       = int(os.getenv("WHISPER_BATCH_MAX",         "8"))
+
+ACK_TMPL = b'{"event":"ack","index":%d}'
+
+class MicroBatcher:
+    """
+    Collects chunks from every connection and transcribes them in a single
+    batched call: everything that queued while the previous call ran, plus
+    whatever arrives within `window_s`, up to `max_items`. A lone chunk on an
+    idle worker is dispatched at once when `window_s` is 0.
+    """
+
+    def __init__(self, pipeline: WhisperPipeline, executor: Executor,
+                 window_s: float, max_items: int):
+        self._pipeline  = pipeline
+        self._executor  = executor
+        self._window_s  = window_s
+        self._max_items = max_items
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+
+    async def submit(self, audio_bytes: bytes, mime_type: str, offset: float) -> List[Segment]:
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((audio_bytes, mime_type, offset, fut))
+        return await fut
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            # Chunks that arrived while the worker was busy join without waiting
+            while len(batch) < self._max_items and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            deadline = loop.time() + self._window_s
+            while len(batch) < self._max_items:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Run Whisper off the event-loop thread
+            chunks = [item[:3] for item in batch]
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, partial(self._pipeline.transcribe_batch, chunks),
+                )
+            except Exception as exc:
+                for *_, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(exc)
+                continue
+
+            for (*_, fut), segments in zip(batch, results):
+                if not fut.done():          # client may have gone away meanwhile
+                    fut.set_result(segments)
+
 # ── Startup: load model once ──────────────────────────────────────────────────
 pipeline: Optional[WhisperPipeline] = None
+batcher:  Optional[MicroBatcher]    = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global pipeline
-    log.info("Loading Whisper model…")
-    pipeline = WhisperPipeline()
-    log.info("Whisper model ready ✓")
-    yield
+    global pipeline, batcher
+    log_listener = _start_logging()
+    try:
+        log.info("Loading Whisper model…")
+        pipeline = get_pipeline()
+        # One dedicated thread feeds Whisper: CTranslate2 already spreads each call
+        # over its own cpu_threads, so more callers would only oversubscribe cores.
+        app.state.whisper_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+        batcher  = MicroBatcher(pipeline, app.state.whisper_pool, BATCH_WINDOW_MS / 1000, BATCH_MAX)
+        batcher.start()
+        log.info("Whisper model ready ✓")
+        yield
+        await batcher.stop()
+        app.state.whisper_pool.shutdown(wait=False)
+    finally:
+        log_listener.stop()   # flushes anything still queued
 
 app = FastAPI(title="Hebrew Live Subtitles", version="2.0.0", lifespan=lifespan)
 
@@ -63,7 +178,7 @@ async def ws_translate(ws: WebSocket):
     log.info("Client connected: %s", ws.client)
 
     # Per-connection state
-    pending_meta: Optional[dict] = None
+    pending_meta: Optional[ChunkMeta] = None
     cumulative_time: float = 0.0        # seconds of audio processed so far
 
     try:
@@ -77,13 +192,10 @@ async def ws_translate(ws: WebSocket):
             # ── Text frame → chunk metadata ───────────────────────────────────
             if raw.get("text"):
                 try:
-                    pending_meta = json.loads(raw["text"])
-                    await ws.send_text(json.dumps({
-                        "event": "ack",
-                        "index": pending_meta.get("index", -1),
-                    }))
-                except json.JSONDecodeError as e:
-                    await ws.send_text(json.dumps({"event": "error", "message": f"Bad JSON: {e}"}))
+                    pending_meta = chunk_meta_decoder.decode(raw["text"])
+                    await ws.send_bytes(ACK_TMPL % pending_meta.index)
+                except msgspec.DecodeError as e:
+                    await ws.send_bytes(orjson.dumps({"event": "error", "message": f"Bad JSON: {e}"}))
                 continue
 
             # ── Binary frame → audio ──────────────────────────────────────────
@@ -91,51 +203,43 @@ async def ws_translate(ws: WebSocket):
                 continue
 
             audio_bytes = raw["bytes"]
-            meta        = pending_meta or {}
+            meta        = pending_meta or ChunkMeta()
             pending_meta = None
 
-            chunk_start  = meta.get("start", cumulative_time)
-            chunk_end    = meta.get("end",   chunk_start + 5.0)
-            mime_type    = meta.get("mimeType", "audio/webm")
-            index        = meta.get("index", -1)
+            chunk_start  = meta.start if meta.start is not None else cumulative_time
+            chunk_end    = meta.end   if meta.end   is not None else chunk_start + 5.0
+            mime_type    = meta.mimeType
+            index        = meta.index
             chunk_dur    = chunk_end - chunk_start
 
             log.info("Chunk #%d | %.1f–%.1fs | %d bytes", index, chunk_start, chunk_end, len(audio_bytes))
 
-            # Run Whisper off the event-loop thread
-            loop = asyncio.get_event_loop()
             try:
-                segments = await loop.run_in_executor(
-                    None,
-                    partial(pipeline.transcribe, audio_bytes, mime_type, chunk_start),
-                )
+                segments = await batcher.submit(audio_bytes, mime_type, chunk_start)
             except Exception as exc:
-                log.error("Whisper error: %s", exc)
-                traceback.print_exc()
-                await ws.send_text(json.dumps({"event": "error", "message": str(exc)}))
+                log.exception("Whisper error: %s", exc)
+                await ws.send_bytes(orjson.dumps({"event": "error", "message": str(exc)}))
                 cumulative_time += chunk_dur
                 continue
 
             # Emit one subtitle message per Whisper segment
             for seg in segments:
-                if seg.text:
-                    log.info("  Subtitle [%.1f–%.1fs]: %s", seg.start, seg.end, seg.text)
-                    await ws.send_text(json.dumps({
-                        "event": "subtitle",
-                        "text":  seg.text,
-                        "start": round(seg.start, 2),
-                        "end":   round(seg.end,   2),
-                    }))
+                log.info("  Subtitle [%.1f–%.1fs]: %s", seg.start, seg.end, seg.text)
+                await ws.send_bytes(orjson.dumps({
+                    "event": "subtitle",
+                    "text":  seg.text,
+                    "start": round(seg.start, 2),
+                    "end":   round(seg.end,   2),
+                }))
 
             cumulative_time += chunk_dur
 
     except WebSocketDisconnect:
         log.info("Client disconnected: %s", ws.client)
     except Exception as exc:
-        log.error("Unhandled error: %s", exc)
-        traceback.print_exc()
+        log.exception("Unhandled error: %s", exc)
         try:
-            await ws.send_text(json.dumps({"event": "error", "message": str(exc)}))
+            await ws.send_bytes(orjson.dumps({"event": "error", "message": str(exc)}))
         except Exception:
             pass
 
@@ -159,12 +263,21 @@ async def test_whisper(request: Request):
     body = await request.body()
     if not body:
         return {"error": "no audio body"}
-    segs = await asyncio.get_event_loop().run_in_executor(
-        None, partial(pipeline.transcribe, body, "audio/wav", 0.0)
-    )
+    segs = await batcher.submit(body, "audio/wav", 0.0)
     return {"segments": [{"text": s.text, "start": s.start, "end": s.end} for s in segs]}
 
 
 # ── Entry point ────────────────────────────────────────────────────────────────
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=False, log_level="info")
+    uvicorn.run(
+        "app:app",
+        host      = "0.0.0.0",
+        port      = 8000,
+        reload    = False,
+        log_level = "info",
+        loop      = "asyncio" if sys.platform == "win32" else "uvloop",   # uvloop has no Windows build
+        http      = "httptools",
+        ws        = "websockets",
+        # Audio arrives as already-compressed WebM/Opus: deflate is pure overhead
+        ws_per_message_deflate = False,
+    )
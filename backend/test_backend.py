@@ -6,11 +6,13 @@ Usage:
   python test_backend.py                          # generate silence + transcribe
   python test_backend.py path/to/audio.wav       # transcribe a real file
   python test_backend.py --ws                    # test the WebSocket endpoint
+  python test_backend.py --mapping               # batch → chunk mapping (no model)
 """
 
 import asyncio
 import io
 import json
+import math
 import struct
 import sys
 import time
@@ -31,13 +33,76 @@ def make_silence_wav(duration_s: float = 5.0, sample_rate: int = 16000) -> bytes
     return buf.getvalue()
 
 
+def make_tone_wav(duration_s: float = 5.0, sample_rate: int = 16000, freq: float = 220.0) -> bytes:
+    """Generate a sine-tone WAV — loud enough to pass the silence gate."""
+    n_samples = int(duration_s * sample_rate)
+    samples = [int(8000 * math.sin(2 * math.pi * freq * n / sample_rate)) for n in range(n_samples)]
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(struct.pack('<' + 'h' * n_samples, *samples))
+    return buf.getvalue()
+
+
+def test_batch_mapping():
+    """
+    Check how a batched faster-whisper call is mapped back to its chunks,
+    without loading a model: VAD keeps every chunk whole and the batched
+    pipeline is stubbed to echo each clip back as one segment.
+    """
+    print("── Batch → chunk mapping test ───────────────────────────")
+    sys.path.insert(0, '.')
+    from types import SimpleNamespace
+    import whisper_pipeline as wp
+
+    def fake_transcribe(audio, clip_timestamps, **kwargs):
+        segs = (SimpleNamespace(
+                    text           = f"clip@{c['start']}",
+                    start          = c['start'] / wp.SAMPLE_RATE,
+                    end            = c['end'] / wp.SAMPLE_RATE,
+                    no_speech_prob = 0.0,
+                    avg_logprob    = 0.0,
+                ) for c in clip_timestamps)
+        return segs, None
+
+    pipeline = wp.WhisperPipeline.__new__(wp.WhisperPipeline)
+    pipeline._backend               = "faster"
+    pipeline._device                = "cpu"
+    pipeline._arena                 = wp._PcmArena()
+    pipeline._chunks_since_gc       = 0
+    pipeline._vad_options           = None
+    pipeline._get_speech_timestamps = lambda audio, opts: [{"start": 0, "end": len(audio)}]
+    pipeline._merge_segments        = lambda spans, opts: spans
+    pipeline._batched               = SimpleNamespace(transcribe=fake_transcribe)
+
+    chunks = [
+        (make_tone_wav(5.0),    'audio/wav', 10.0),   # speech
+        (make_silence_wav(5.0), 'audio/wav', 15.0),   # dropped by the silence gate
+        (make_tone_wav(5.0),    'audio/wav', 40.0),   # speech, follows chunk 0 in the buffer
+    ]
+    results = pipeline.transcribe_batch(chunks)
+    for i, segs in enumerate(results):
+        print(f"  chunk {i}: " + ", ".join(f"[{s.start:.2f}–{s.end:.2f}] {s.text}" for s in segs))
+
+    n = 5 * wp.SAMPLE_RATE
+    assert [len(segs) for segs in results] == [1, 0, 1], results
+    # Chunk 2's samples sit right after chunk 0's: the silent chunk took no space
+    assert results[0][0].text == "clip@0" and results[2][0].text == f"clip@{n}", results
+    assert abs(results[0][0].start - 10.0) < 1e-6 and abs(results[0][0].end - 15.0) < 1e-6, results
+    assert abs(results[2][0].start - 40.0) < 1e-6 and abs(results[2][0].end - 45.0) < 1e-6, results
+    print("  segments mapped to the right chunk and time ✓")
+    print()
+
+
 def test_pipeline_local(audio_path: str = None):
     """Load model locally and run transcription — no HTTP needed."""
     print("── Local pipeline test ──────────────────────────────────")
     sys.path.insert(0, '.')
-    from whisper_pipeline import WhisperPipeline
+    from whisper_pipeline import get_pipeline
 
-    pipeline = WhisperPipeline()
+    pipeline = get_pipeline()
 
     if audio_path:
         with open(audio_path, 'rb') as f:
@@ -100,7 +165,9 @@ async def test_websocket(url: str = "ws://localhost:8000/ws/translate"):
 if __name__ == "__main__":
     args = sys.argv[1:]
 
-    if "--ws" in args:
+    if "--mapping" in args:
+        test_batch_mapping()
+    elif "--ws" in args:
         url = next((a for a in args if a.startswith("ws://")), "ws://localhost:8000/ws/translate")
         asyncio.run(test_websocket(url))
     else:
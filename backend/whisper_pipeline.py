@@ -2,82 +2,60 @@
 whisper_pipeline.py — Hebrew audio → English subtitles via Whisper
 
 Optimized for speed: 
-- Uses in-memory processing (BytesIO) for faster-whisper to avoid disk I/O latency.
-- Falls back to temp files only for openai-whisper.
+- Decodes chunks in-process with PyAV (libav) straight to 16 kHz float32 PCM
+  for both backends — no ffmpeg subprocess, no WAV round-trip, no temp files.
+- Transcribes queued chunks together through BatchedInferencePipeline so one
+  encoder pass serves every waiting connection.
+- Runs Silero VAD up front and only sends speech spans to the encoder.
 """
 
+import bisect
+import functools
 import io
 import logging
 import os
-import shutil
-import tempfile
 import time
 from dataclasses import dataclass
-from typing import List, Optional
+from types import MappingProxyType
+from typing import List, Optional, Tuple
 
-log = logging.getLogger("whisper_pipeline")
+import av
+import numpy as np
 
-_ffmpeg_configured = False
-
-def _find_ffmpeg_candidates() -> List[str]:
-    candidates = []
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    candidates.append(script_dir)
-    candidates.append(os.path.join(script_dir, "ffmpeg", "bin"))
-    for name in ("C:\\ffmpeg\\bin", "C:\\ffmpeg", "C:\\Program Files\\ffmpeg\\bin"):
-        if os.path.isdir(name):
-            candidates.append(name)
-    return candidates
-
-def _configure_ffmpeg_path() -> None:
-    global _ffmpeg_configured
-    if _ffmpeg_configured:
-        return
-    base = os.getenv("FFMPEG_PATH") or os.getenv("FFMPEG_BIN")
-    if base and base.strip():
-        base = os.path.normpath(base.strip())
-        if base.lower().endswith((".exe", ".bat")):
-            ffmpeg_path = base
-            ffprobe_dir = os.path.dirname(base)
-        else:
-            ffprobe_dir = base
-            ffmpeg_path = os.path.join(base, "ffmpeg.exe")
-    else:
-        if shutil.which("ffmpeg"):
-            _ffmpeg_configured = True
-            return
-        ffmpeg_path = None
-        ffprobe_dir = None
-        for d in _find_ffmpeg_candidates():
-            exe = os.path.join(d, "ffmpeg.exe")
-            if os.path.isfile(exe):
-                ffmpeg_path = exe
-                ffprobe_dir = d
-                break
-        if not ffmpeg_path or not ffprobe_dir:
-            _ffmpeg_configured = True
-            return
-    ffprobe_path = os.path.join(ffprobe_dir, "ffprobe.exe")
-    if not os.path.isfile(ffmpeg_path):
-        _ffmpeg_configured = True
-        return
-    import pydub.utils as pydub_utils
-    from pydub import AudioSegment
-    AudioSegment.converter = ffmpeg_path
-    _original_get_prober = pydub_utils.get_prober_name
-
-    def _get_prober_name():
-        if os.path.isfile(ffprobe_path):
-            return ffprobe_path
-        return _original_get_prober()
-
-    pydub_utils.get_prober_name = _get_prober_name
-    log.info("Using ffmpeg at %s", ffmpeg_path)
-    _ffmpeg_configured = True
+log = logging.getLogger("whisper_pipeline")
 
 BACKEND   = os.getenv("WHISPER_BACKEND", "faster").lower()
 MODEL_ID  = os.getenv("WHISPER_MODEL",   "small")
 USE_GPU   = os.getenv("WHISPER_GPU",     "auto").lower()
+BEAM_SIZE = int(os.getenv("WHISPER_BEAM",  "1"))   # 1 = greedy; raise for accuracy
+
+# Release cached CUDA memory every N chunks so long-running servers stay bounded
+CUDA_GC_EVERY = int(os.getenv("WHISPER_CUDA_GC_EVERY", "50"))
+
+# CTranslate2 tuning (faster-whisper only)
+CT2_COMPUTE = os.getenv("CT2_COMPUTE", "")          # empty = best supported type
+CT2_THREADS = int(os.getenv("CT2_THREADS", str(os.cpu_count() or 4)))
+CT2_WORKERS = int(os.getenv("CT2_WORKERS", "1"))
+CT2_FLASH_ATTENTION = os.getenv("CT2_FLASH_ATTENTION", "true").lower() == "true"   # CUDA only, probed at load
+
+# Faster-decoder models that can't do Hebrew → English: distil-* and *.en are
+# English-only, and large-v3-turbo was not trained on the translate task.
+_NO_TRANSLATE_MODELS = ("distil", ".en", "turbo")
+
+SAMPLE_RATE = 16000   # Whisper's native input rate
+MAX_CLIP_SAMPLES = 30 * SAMPLE_RATE   # Whisper's 30 s encoder window
+BATCH_SIZE  = int(os.getenv("WHISPER_BATCH_SIZE", "16"))   # clips per encoder pass
+NO_SPEECH_THRESHOLD = 0.55
+LOG_PROB_THRESHOLD  = -1.0   # a "no speech" segment is only dropped if also low-confidence
+
+# Chunks quieter than this are dropped before VAD/Whisper (float PCM, full scale = 1.0)
+SILENCE_RMS  = float(os.getenv("WHISPER_SILENCE_RMS",  "0.001"))
+SILENCE_PEAK = float(os.getenv("WHISPER_SILENCE_PEAK", "0.01"))
+
+_BLANK_TEXTS = ("[BLANK_AUDIO]", "[Music]", "(Music)")
+
+# (audio_bytes, mime_type, time_offset) — one queued chunk
+ChunkRequest = Tuple[bytes, str, float]
 
 @dataclass
 class Segment:
@@ -85,26 +63,155 @@ class Segment:
     start: float
     end:   float
 
+class _PcmArena:
+    """
+    Float32 buffer that decoded chunks are written into. It is reset, not
+    reallocated, for every batch, so steady-state decoding does no per-chunk
+    array allocation or concatenation. It grows for oversized input (e.g. a
+    long /test-whisper upload) but shrinks back to `capacity` on the next
+    reset, so one big request doesn't pin that memory for the process' life.
+    """
+
+    def __init__(self, capacity: int = SAMPLE_RATE * 60):
+        self._capacity = capacity
+        self._buf      = np.empty(capacity, dtype=np.float32)
+        self.size      = 0
+
+    def reset(self) -> None:
+        self.size = 0
+        if len(self._buf) > self._capacity:
+            self._buf = np.empty(self._capacity, dtype=np.float32)
+
+    def truncate(self, size: int) -> None:
+        self.size = size
+
+    def append(self, samples: np.ndarray) -> None:
+        end = self.size + len(samples)
+        if end > len(self._buf):
+            grown = np.empty(max(end, 2 * len(self._buf)), dtype=np.float32)
+            grown[:self.size] = self._buf[:self.size]
+            self._buf = grown
+        self._buf[self.size:end] = samples
+        self.size = end
+
+    def view(self, start: int = 0) -> np.ndarray:
+        return self._buf[start:self.size]
+
+class _TorchFeatureExtractor:
+    """
+    Drop-in for faster-whisper's FeatureExtractor that computes the log-Mel
+    spectrogram with torch on the GPU (STFT + mel projection), reusing the
+    original extractor's mel filters and settings so features are identical.
+    """
+
+    def __init__(self, base, device: str = "cuda"):
+        import torch
+        self._torch       = torch
+        self._base        = base
+        self._device      = device
+        self._window      = torch.hann_window(base.n_fft, device=device)
+        self._mel_filters = torch.from_numpy(base.mel_filters).to(device)
+
+    def __getattr__(self, name):
+        # n_samples, hop_length, time_per_frame, … come from the wrapped extractor
+        return getattr(self._base, name)
+
+    def __call__(self, waveform: np.ndarray, padding: int = 160, chunk_length: Optional[int] = None) -> np.ndarray:
+        torch = self._torch
+        base  = self._base
+        if chunk_length is not None:
+            base.n_samples     = chunk_length * base.sampling_rate
+            base.nb_max_frames = base.n_samples // base.hop_length
+
+        x = torch.from_numpy(np.ascontiguousarray(waveform, dtype=np.float32)).to(self._device, non_blocking=True)
+        if padding:
+            x = torch.nn.functional.pad(x, (0, padding))
+        stft       = torch.stft(x, base.n_fft, base.hop_length, window=self._window, return_complex=True)
+        magnitudes = stft[..., :-1].abs() ** 2
+
+        log_spec = (self._mel_filters @ magnitudes).clamp(min=1e-10).log10()
+        log_spec = torch.maximum(log_spec, log_spec.max() - 8.0)
+        log_spec = (log_spec + 4.0) / 4.0
+        return log_spec.cpu().numpy()
+
 class WhisperPipeline:
     def __init__(self):
         self.model_name = MODEL_ID
         self._device    = self._pick_device()
         self._backend   = BACKEND
+        self._chunks_since_gc = 0
+        self._arena     = _PcmArena()   # only touched by the single transcribing thread
 
         log.info("Device: %s | Backend: %s | Model: %s", self._device, BACKEND, MODEL_ID)
+        if any(tag in MODEL_ID.lower() for tag in _NO_TRANSLATE_MODELS):
+            log.warning("%s cannot translate Hebrew → English reliably — "
+                        "use small/medium/large-v3 for subtitles", MODEL_ID)
 
         if BACKEND == "faster":
             self._load_faster_whisper()
         else:
             self._load_openai_whisper()
+        self._warmup()
+
+    def _warmup(self):
+        # One dummy forward pass at startup so kernel selection, CUDA autotune
+        # and allocator growth happen here instead of on the first real chunk.
+        warmup = np.zeros(SAMPLE_RATE * 15, dtype=np.float32)
+        t0 = time.time()
+        try:
+            if self._backend == "faster":
+                segs, _ = self._batched.transcribe(
+                    warmup,
+                    task               = "translate",
+                    language           = "he",
+                    beam_size          = BEAM_SIZE,
+                    best_of            = 1,
+                    temperature        = 0.0,
+                    without_timestamps = False,
+                    clip_timestamps    = [{"start": 0, "end": len(warmup)}],
+                )
+                list(segs)   # segments are lazy — consume to actually run
+            else:
+                self._model.transcribe(
+                    warmup,
+                    task        = "translate",
+                    language    = "he",
+                    fp16        = (self._device == "cuda"),
+                    verbose     = None,
+                    temperature = 0.0,
+                )
+            log.info("Warm-up pass done in %.1fs ✓", time.time() - t0)
+        except Exception as e:
+            log.warning("Warm-up pass failed (first chunk will be slower): %s", e)
 
     def _load_faster_whisper(self):
         try:
-            from faster_whisper import WhisperModel
-            compute = "float16" if self._device == "cuda" else "int8"
+            from faster_whisper import BatchedInferencePipeline, WhisperModel
+            from faster_whisper.vad import VadOptions, get_speech_timestamps, merge_segments
+            compute = self._pick_compute_type()
             log.info("Loading faster-whisper/%s on %s (%s)…", MODEL_ID, self._device, compute)
             t0 = time.time()
-            self._model   = WhisperModel(MODEL_ID, device=self._device, compute_type=compute)
+            if self._device == "cuda":
+                self._model = self._load_cuda_model(WhisperModel, compute)
+            else:
+                self._model = WhisperModel(
+                    MODEL_ID,
+                    device       = "cpu",
+                    compute_type = compute,
+                    cpu_threads  = CT2_THREADS,
+                    num_workers  = CT2_WORKERS,
+                )
+            self._batched = BatchedInferencePipeline(model=self._model)
+            # VAD helpers/options are resolved once here, not on every batch
+            self._get_speech_timestamps = get_speech_timestamps
+            self._merge_segments        = merge_segments
+            self._vad_options = VadOptions(
+                min_speech_duration_ms = 200,
+                min_silence_duration_ms= 500,
+                max_speech_duration_s  = MAX_CLIP_SAMPLES / SAMPLE_RATE,
+            )
+            if self._device == "cuda":
+                self._use_gpu_features()
             self._backend = "faster"
             log.info("faster-whisper ready in %.1fs ✓", time.time() - t0)
         except ImportError:
@@ -112,6 +219,47 @@ class WhisperPipeline:
             self._backend = "openai"
             self._load_openai_whisper()
 
+    def _load_cuda_model(self, WhisperModel, compute: str):
+        # Flash attention (fused, tiled attention kernels) needs float16/bfloat16
+        # activations, an Ampere+ GPU and a CTranslate2 build compiled with it —
+        # stock pip wheels aren't, and only fail on the first encode. So run a
+        # probe forward pass here and fall back to the plain load if it fails.
+        if CT2_FLASH_ATTENTION:
+            flash_compute = CT2_COMPUTE or "float16"
+            try:
+                model = WhisperModel(MODEL_ID, device="cuda", compute_type=flash_compute,
+                                     flash_attention=True)
+                self._probe_forward(model)
+                log.info("Flash attention enabled (%s) ✓", flash_compute)
+                return model
+            except (TypeError, ValueError, RuntimeError) as e:
+                log.warning("Flash attention unavailable, loading without it: %s", e)
+        return WhisperModel(MODEL_ID, device="cuda", compute_type=compute)
+
+    @staticmethod
+    def _probe_forward(model) -> None:
+        # One encoder + decoder pass over 1 s of silence; raises if the kernels can't run
+        from faster_whisper import BatchedInferencePipeline
+        probe = np.zeros(SAMPLE_RATE, dtype=np.float32)
+        segs, _ = BatchedInferencePipeline(model=model).transcribe(
+            probe,
+            task            = "translate",
+            language        = "he",
+            beam_size       = 1,
+            max_new_tokens  = 1,
+            clip_timestamps = [{"start": 0, "end": len(probe)}],
+        )
+        list(segs)
+
+    def _use_gpu_features(self):
+        # faster-whisper extracts log-Mels with numpy on the CPU; swap in the
+        # torch version so the STFT and mel projection run on the GPU instead.
+        try:
+            self._model.feature_extractor = _TorchFeatureExtractor(self._model.feature_extractor)
+            log.info("Mel features on GPU (torch) ✓")
+        except Exception as e:   # torch missing or built without CUDA
+            log.warning("GPU feature extraction unavailable, staying on CPU: %s", e)
+
     def _load_openai_whisper(self):
         import whisper # type: ignore
         log.info("Loading openai-whisper/%s on %s…", MODEL_ID, self._device)
@@ -125,66 +273,105 @@ class WhisperPipeline:
         mime_type:   str   = "audio/webm",
         time_offset: float = 0.0,
     ) -> List[Segment]:
-        if not audio_bytes or len(audio_bytes) < 512:
-            return []
+        return self.transcribe_batch([(audio_bytes, mime_type, time_offset)])[0]
+
+    def transcribe_batch(self, chunks: List[ChunkRequest]) -> List[List[Segment]]:
+        """Transcribe several chunks in one call; results come back in input order."""
+        try:
+            return self._transcribe_batch(chunks)
+        finally:
+            self._release_cuda_cache(len(chunks))
 
-        wav_bytes = self._decode_to_wav(audio_bytes, mime_type)
-        if wav_bytes is None:
-            return []
+    def _transcribe_batch(self, chunks: List[ChunkRequest]) -> List[List[Segment]]:
+        # ── OPTIMIZATION: PyAV decodes every chunk straight into one reused float32 arena ──
+        arena = self._arena
+        arena.reset()
+        ranges: List[Optional[Tuple[int, int]]] = []
+        for audio_bytes, mime_type, _ in chunks:
+            start = arena.size
+            if (audio_bytes and len(audio_bytes) >= 512
+                    and self._decode_into(arena, audio_bytes, mime_type)
+                    and not _is_silent(arena.view(start))):
+                ranges.append((start, arena.size))
+            else:
+                arena.truncate(start)   # drop undecodable / silent samples
+                ranges.append(None)
+        pcm     = arena.view()
+        offsets = [offset for _, _, offset in chunks]
 
         t0 = time.time()
-        
-        # ── OPTIMIZATION: RAM-only processing for faster-whisper ──
         if self._backend == "faster":
-            # Pass file-like object directly to faster-whisper (No Disk I/O)
-            file_obj = io.BytesIO(wav_bytes)
-            segments = self._run_faster(file_obj, time_offset)
+            results = self._run_faster_batch(pcm, ranges, offsets)
         else:
-            # openai-whisper requires a real file path
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
-                f.write(wav_bytes)
-                tmp = f.name
-            try:
-                segments = self._run_openai(tmp, time_offset)
-            finally:
-                try: os.unlink(tmp)
-                except OSError: pass
-
-        log.info("Whisper %.2fs → %d segment(s)", time.time() - t0, len(segments))
-        return segments
-
-    def _run_faster(self, audio_input, offset: float) -> List[Segment]:
-        # audio_input can be a file path OR a binary file-like object
-        segs, info = self._model.transcribe(
-            audio_input,
+            results = [self._run_openai(pcm[rng[0]:rng[1]], offset) if rng is not None else []
+                       for rng, offset in zip(ranges, offsets)]
+        log.info("Whisper %.2fs → %d chunk(s), %d segment(s)",
+                 time.time() - t0, len(chunks), sum(len(r) for r in results))
+        return results
+
+    def _run_faster_batch(self, pcm: np.ndarray, ranges: List[Optional[Tuple[int, int]]],
+                          offsets: List[float]) -> List[List[Segment]]:
+        # Run Silero VAD on each chunk ourselves, merge its speech spans into
+        # clips of at most 30 s, and hand every clip of every chunk to the
+        # batched pipeline in one call over the shared PCM buffer. All-silent
+        # chunks never reach the encoder. faster-whisper 1.1.x gives every clip
+        # its own 30 s window, so a clip never mixes two chunks' (or two users')
+        # audio; 1.2 packs neighbouring clips together, hence the <1.2 pin.
+        results: List[List[Segment]] = [[] for _ in ranges]
+        vad_options = self._vad_options
+        clips, starts, owners = [], [], []
+        for i, rng in enumerate(ranges):
+            if rng is None:
+                continue
+            start, end = rng
+            spans = self._merge_segments(self._get_speech_timestamps(pcm[start:end], vad_options), vad_options)
+            if not spans:
+                continue
+            for span in spans:
+                clips.append({"start": start + span["start"], "end": start + span["end"]})
+            starts.append(start)
+            owners.append(i)
+        if not clips:
+            return results
+
+        segs, info = self._batched.transcribe(
+            pcm,
             task               = "translate",
             language           = "he",
-            beam_size          = 5,
-            vad_filter         = True,
-            vad_parameters     = dict(min_silence_duration_ms=500),
-            no_speech_threshold= 0.55,
+            beam_size          = BEAM_SIZE,
+            best_of            = 1,
             temperature        = 0.0,
+            without_timestamps = False,
+            clip_timestamps    = clips,
+            batch_size         = BATCH_SIZE,
         )
-        results = []
         for s in segs:
             text = s.text.strip()
-            if text and text not in ("[BLANK_AUDIO]", "[Music]", "(Music)"):
-                results.append(Segment(
-                    text  = text,
-                    start = offset + s.start,
-                    end   = offset + s.end,
-                ))
+            if not text or text in _BLANK_TEXTS:
+                continue
+            # Same rule faster-whisper's sequential path uses for no_speech_threshold
+            if s.no_speech_prob > NO_SPEECH_THRESHOLD and s.avg_logprob < LOG_PROB_THRESHOLD:
+                continue
+            # Segment times are relative to the whole buffer — map back to its chunk
+            k    = bisect.bisect_right(starts, (s.start + s.end) / 2 * SAMPLE_RATE) - 1
+            i    = owners[k]
+            base = starts[k] / SAMPLE_RATE
+            results[i].append(Segment(
+                text  = text,
+                start = offsets[i] + s.start - base,
+                end   = offsets[i] + s.end - base,
+            ))
         return results
 
-    def _run_openai(self, wav_path: str, offset: float) -> List[Segment]:
-        import whisper # type: ignore
+    def _run_openai(self, audio: np.ndarray, offset: float) -> List[Segment]:
+        # openai-whisper also accepts mono float32 @16 kHz directly — no temp WAV, no ffmpeg
         result = self._model.transcribe(
-            wav_path,
+            audio,
             task                         = "translate",
             language                     = "he",
             fp16                         = (self._device == "cuda"),
             verbose                      = False,
-            no_speech_threshold          = 0.55,
+            no_speech_threshold          = NO_SPEECH_THRESHOLD,
             temperature                  = 0.0,
         )
         results = []
@@ -198,19 +385,52 @@ class WhisperPipeline:
                 ))
         return results
 
-    def _decode_to_wav(self, audio_bytes: bytes, mime_type: str) -> Optional[bytes]:
-        _configure_ffmpeg_path()
+    def _decode_into(self, arena: _PcmArena, audio_bytes: bytes, mime_type: str) -> bool:
+        """Decode one chunk to mono float32 @16 kHz, appending it to `arena`."""
+        start = arena.size
         try:
-            from pydub import AudioSegment as AS
-            fmt   = _mime_to_fmt(mime_type)
-            audio = AS.from_file(io.BytesIO(audio_bytes), format=fmt)
-            audio = audio.set_frame_rate(16000).set_channels(1).set_sample_width(2)
-            buf   = io.BytesIO()
-            audio.export(buf, format="wav")
-            return buf.getvalue()
+            fmt       = _mime_to_fmt(mime_type)
+            resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLE_RATE)
+            # BytesIO over bytes shares the buffer — no copy of the chunk
+            with av.open(io.BytesIO(audio_bytes), format=fmt) as container:
+                stream = container.streams.audio[0]
+                for frame in container.decode(stream):
+                    for rf in resampler.resample(frame):
+                        arena.append(rf.to_ndarray().reshape(-1))
+            # Flush samples still buffered inside the resampler
+            for rf in resampler.resample(None):
+                arena.append(rf.to_ndarray().reshape(-1))
+            return arena.size > start
         except Exception as e:
             log.error("Audio decode failed (%s): %s", mime_type, e)
-            return None
+            return False
+
+    def _release_cuda_cache(self, n_chunks: int) -> None:
+        if self._device != "cuda":
+            return
+        self._chunks_since_gc += n_chunks
+        if self._chunks_since_gc < CUDA_GC_EVERY:
+            return
+        self._chunks_since_gc = 0
+        # No gc.collect() here: a full collection holds the GIL on this worker
+        # thread and would stall the event loop for every connection.
+        try:
+            import torch
+            torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+    def _pick_compute_type(self) -> str:
+        # int8 weights with 16-bit activations where the hardware supports
+        # them (fp16 on GPU, AVX-512 FP16/BF16 on CPU); plain int8 otherwise.
+        if CT2_COMPUTE:
+            return CT2_COMPUTE
+        import ctranslate2
+        supported = ctranslate2.get_supported_compute_types(self._device)
+        for compute in ("int8_float16", "int8_bfloat16", "int8"):
+            if compute in supported:
+                return compute
+        return "default"
 
     @staticmethod
     def _pick_device() -> str:
@@ -228,15 +448,38 @@ class WhisperPipeline:
             pass
         return "cpu"
 
+@functools.lru_cache(maxsize=1)
+def _pipeline_for_pid(pid: int) -> "WhisperPipeline":
+    return WhisperPipeline()
+
+def get_pipeline() -> WhisperPipeline:
+    """Return this process's shared WhisperPipeline, loading the model on first use."""
+    # Keyed on the PID so a forked worker (uvicorn --workers N) loads its own
+    # model once instead of reusing the parent's CTranslate2/CUDA handles.
+    return _pipeline_for_pid(os.getpid())
+
+def _is_silent(audio: np.ndarray) -> bool:
+    # One vectorised pass is far cheaper than VAD + an encoder forward
+    if not len(audio):
+        return True
+    peak = max(float(audio.max()), -float(audio.min()))
+    if peak < SILENCE_PEAK:
+        return True
+    rms = np.sqrt(float(np.dot(audio, audio)) / len(audio))
+    return rms < SILENCE_RMS
+
+_MIME_TABLE = MappingProxyType({
+    "audio/webm":            "webm",
+    "audio/webm;codecs=opus":"webm",
+    "audio/ogg":             "ogg",
+    "audio/ogg;codecs=opus": "ogg",
+    "audio/mp4":             "mp4",
+    "audio/mpeg":            "mp3",
+    "audio/wav":             "wav",
+})
+
+@functools.lru_cache(maxsize=32)
 def _mime_to_fmt(mime_type: str) -> str:
-    table = {
-        "audio/webm":            "webm",
-        "audio/webm;codecs=opus":"webm",
-        "audio/ogg":             "ogg",
-        "audio/ogg;codecs=opus": "ogg",
-        "audio/mp4":             "mp4",
-        "audio/mpeg":            "mp3",
-        "audio/wav":             "wav",
-    }
-    base = mime_type.split(";")[0].strip().lower()
-    return table.get(mime_type.lower(), table.get(base, "webm"))
\ No newline at end of file
+    # A client sends the same MIME on every chunk, so this is almost always a cache hit
+    return (_MIME_TABLE.get(mime_type.lower())
+            or _MIME_TABLE.get(mime_type.split(";", 1)[0].strip().lower(), "webm"))
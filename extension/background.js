@@ -3,6 +3,7 @@ let currentTabId = null;
 let config = {};
 let wsReconnectTimer = null;
 let isRunning = false;
+const utf8 = new TextDecoder();   // backend sends JSON as binary frames
 
 chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
   if (msg.type === 'START_CAPTURE') {
@@ -89,6 +90,7 @@ function handleAudioChunk(chunkBase64, metadata) {
 function openWebSocket(url, attempt = 0) {
   return new Promise((resolve, reject) => {
     const ws = new WebSocket(url);
+    ws.binaryType = 'arraybuffer';
     socket = ws;
     const t = setTimeout(() => { ws.close(); reject(new Error('timeout')); }, 7000);
     ws.onopen = () => { clearTimeout(t); notifyStatus('connected', 'active'); resolve(ws); };
@@ -106,7 +108,8 @@ function openWebSocket(url, attempt = 0) {
 // ── FIXED FUNCTION (Robust Message Handling) ─────────────────────────────────
 function handleServerMessage(event) {
   let msg;
-  try { msg = JSON.parse(event.data); } catch (e) { return; }
+  const data = typeof event.data === 'string' ? event.data : utf8.decode(event.data);
+  try { msg = JSON.parse(data); } catch (e) { return; }
 
   // 1. Handle Subtitles
   if (msg.event === 'subtitle' && msg.text && msg.text.trim()) {